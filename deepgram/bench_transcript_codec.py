@@ -0,0 +1,99 @@
+"""
+Benchmark transcript encodings sent to clients.
+
+Compares the encoded size and encode/decode cost of a representative
+Deepgram Results message in JSON, MessagePack and CBOR, each for the full
+message (what JSON sessions receive), the default projection and the
+projection with word arrays (?words=true).
+
+Usage: python bench_transcript_codec.py [iterations]
+"""
+import json
+import sys
+import timeit
+
+import msgpack
+
+from transcript_codec import (
+    SUBPROTOCOL_CBOR,
+    SUBPROTOCOL_MSGPACK,
+    ENCODERS,
+    build_projection,
+    cbor2,
+)
+
+
+def sample_results_message(word_count: int = 12) -> dict:
+    words = []
+    for i in range(word_count):
+        words.append({
+            "word": f"word{i}",
+            "start": 0.32 * i,
+            "end": 0.32 * i + 0.28,
+            "confidence": 0.9871234,
+            "punctuated_word": f"Word{i}",
+        })
+    return {
+        "type": "Results",
+        "channel_index": [0, 1],
+        "duration": 3.84,
+        "start": 12.16,
+        "is_final": True,
+        "speech_final": True,
+        "channel": {
+            "alternatives": [{
+                "transcript": " ".join(w["punctuated_word"] for w in words),
+                "confidence": 0.9912345,
+                "words": words,
+            }],
+        },
+        "metadata": {
+            "request_id": "5c6b3a2e-3f1d-4bde-9f51-2f0c1a0c9e7a",
+            "model_info": {
+                "name": "general-nova-3",
+                "version": "2024-12-20.0",
+                "arch": "nova-3",
+            },
+            "model_uuid": "3b3aabe4-608a-46ac-9585-7960a25daf1a",
+        },
+        "from_finalize": False,
+    }
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    message = sample_results_message()
+
+    decoders = {SUBPROTOCOL_MSGPACK: msgpack.unpackb}
+    if cbor2 is not None:
+        decoders[SUBPROTOCOL_CBOR] = cbor2.loads
+
+    # Each encoding is measured on the full message and on both projections,
+    # so the cost of the encoding and the effect of dropping fields can be
+    # read separately
+    shapes = [
+        ("full", lambda m: m),
+        ("projected", build_projection(include_words=False)),
+        ("projected +words", build_projection(include_words=True)),
+    ]
+    codecs = [("json", lambda m: json.dumps(m).encode("utf-8"), json.loads)]
+    for subprotocol, encode in ENCODERS.items():
+        codecs.append((subprotocol, encode, decoders[subprotocol]))
+
+    cases = []
+    for codec_name, encode, decode in codecs:
+        for shape_name, project in shapes:
+            cases.append((f"{codec_name} ({shape_name})",
+                          lambda encode=encode, project=project: encode(project(message)),
+                          decode))
+
+    print(f"{'encoding':<36}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for label, encode, decode in cases:
+        payload = encode()
+        encode_us = timeit.timeit(encode, number=iterations) / iterations * 1e6
+        decode_us = timeit.timeit(lambda: decode(payload), number=iterations) / iterations * 1e6
+        print(f"{label:<36}{len(payload):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,28 @@
 import os
 import asyncio
+import hmac
 import json
 import logging
+import random
+import signal
 import uuid
 from typing import Dict, List, Optional
 
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import boto3
 from botocore.exceptions import ClientError
 
-from deepgram import Deepgram
-
 from dotenv import load_dotenv
 
+from deepgram_live import DEFAULT_API_URL, DeepgramLive
+from session_capture import open_capture
+from session_registry import DRAINING_REJECT_CODE, Session, SessionRegistry, reconnect_message
+from transcript_codec import TranscriptEncoder, negotiate, send_control
+
 # Load environment variables
 load_dotenv()
 
@@ -76,18 +83,25 @@ except Exception as e:
     print(f"DEEPGRAM DEBUG: Failed to get secret: {e}")
     raise ValueError(f"Failed to retrieve DEEPGRAM_API_KEY from AWS Secrets Manager: {e}")
 
-# Initialize Deepgram client
-print(f"DEEPGRAM DEBUG: Initializing Deepgram client...")
-try:
-    deepgram = Deepgram(DEEPGRAM_API_KEY)
-    print(f"DEEPGRAM DEBUG: Deepgram client initialized successfully")
-except Exception as e:
-    print(f"DEEPGRAM DEBUG: Failed to initialize Deepgram: {e}")
-    raise
+# Deepgram upstream settings
+# DEEPGRAM_API_URL lets the replay tool point the relay at a local fake upstream
+DEEPGRAM_API_URL = os.getenv("DEEPGRAM_API_URL", DEFAULT_API_URL)
+# Batch audio frames smaller than this into one upstream write (0 sends each frame as it arrives)
+DEEPGRAM_COALESCE_BYTES = int(os.getenv("DEEPGRAM_COALESCE_BYTES", "0"))
+DEEPGRAM_FLUSH_INTERVAL = float(os.getenv("DEEPGRAM_FLUSH_INTERVAL", "0.02"))
+DEEPGRAM_KEEPALIVE_INTERVAL = float(os.getenv("DEEPGRAM_KEEPALIVE_INTERVAL", "5"))
 
-# Store active websocket connections
-active_connections: Dict[str, WebSocket] = {}
-dg_connections: Dict[str, object] = {}
+# Live client sessions; sessions with no inbound audio for SESSION_IDLE_TIMEOUT seconds are reaped
+sessions = SessionRegistry(
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "60")),
+    reap_interval=float(os.getenv("SESSION_REAP_INTERVAL", "10")),
+)
+
+# Drain settings used on SIGTERM or POST /admin/drain
+DRAIN_GRACE_PERIOD = float(os.getenv("DRAIN_GRACE_PERIOD", "30"))
+DRAIN_RECONNECT_SPREAD = float(os.getenv("DRAIN_RECONNECT_SPREAD", "10"))
+# The admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 class TranscriptionOptions:
     def __init__(self):
@@ -106,20 +120,70 @@ class TranscriptionOptions:
 async def root():
     return {"message": "Deepgram WebSocket API Server"}
 
+@app.on_event("startup")
+async def start_session_reaper():
+    sessions.record_baseline()
+    sessions.start_reaper()
+
+@app.on_event("shutdown")
+async def stop_session_reaper():
+    sessions.stop_reaper()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for AWS App Runner"""
+    if sessions.draining:
+        # Failing the check takes the instance out of rotation while sessions hand off
+        return JSONResponse(status_code=503, content={"status": "draining", "active_sessions": len(sessions)})
     return {"status": "healthy"}
 
+def require_admin(x_admin_token: Optional[str]):
+    if not ADMIN_TOKEN or not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/admin/drain")
+async def admin_drain(x_admin_token: Optional[str] = Header(None)):
+    """Start draining this instance ahead of scale-in or a redeploy"""
+    require_admin(x_admin_token)
+    sessions.start_drain(DRAIN_GRACE_PERIOD, DRAIN_RECONNECT_SPREAD)
+    return {"status": "draining", "active_sessions": len(sessions), "grace_period": DRAIN_GRACE_PERIOD}
+
+@app.get("/sessions")
+async def session_stats(x_admin_token: Optional[str] = Header(None)):
+    """Per-session traffic and buffer stats plus process memory, for capacity planning"""
+    require_admin(x_admin_token)
+    return sessions.stats()
+
 
 @app.websocket("/")
 async def websocket_endpoint(websocket: WebSocket):
     # Generate a unique ID for this connection
     client_id = str(uuid.uuid4())
     
-    await websocket.accept()
-    logger.info(f"WebSocket connection accepted for client {client_id}")
-    active_connections[client_id] = websocket
+    # JSON text stays the default; clients may negotiate a compact binary encoding
+    subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    encoder = None
+    if subprotocol:
+        include_words = websocket.query_params.get("words", "false").lower() == "true"
+        encoder = TranscriptEncoder(subprotocol, include_words=include_words)
+    
+    await websocket.accept(subprotocol=subprotocol)
+    
+    if sessions.draining:
+        # Point the client elsewhere instead of starting a session we would soon cut off
+        logger.info(f"Rejecting client {client_id}, server is draining")
+        retry_after_ms = int(random.random() * DRAIN_RECONNECT_SPREAD * 1000)
+        try:
+            await send_control(websocket, encoder, reconnect_message(retry_after_ms, 0))
+            await websocket.close(code=DRAINING_REJECT_CODE, reason="server draining")
+        except Exception as e:
+            logger.info(f"Could not send reconnect hint to client {client_id}: {e}")
+        return
+    
+    logger.info(f"WebSocket connection accepted for client {client_id} (subprotocol: {subprotocol or 'json'})")
+    # Opt-in session recording for replay, enabled by setting CAPTURE_DIR
+    session = Session(client_id, websocket, encoder=encoder, capture=open_capture(client_id))
+    sessions.add(session)
     
     try:
         # Configure default Deepgram transcription options to match Swift client
@@ -130,7 +194,7 @@ async def websocket_endpoint(websocket: WebSocket):
         options.channels = 1
         
         # Create WebSocket connection to Deepgram
-        deepgram_socket = await deepgram.transcription.live({
+        deepgram_socket = DeepgramLive(DEEPGRAM_API_KEY, {
             'language': options.language,
             'model': options.model,
             'smart_format': options.smart_format,
@@ -141,53 +205,85 @@ async def websocket_endpoint(websocket: WebSocket):
             'channels': options.channels,
             'sample_rate': options.sample_rate,
             'utterances': options.utterances
-        })
-        
-        dg_connections[client_id] = deepgram_socket
+        }, api_url=DEEPGRAM_API_URL,
+            keepalive_interval=DEEPGRAM_KEEPALIVE_INTERVAL,
+            coalesce_bytes=DEEPGRAM_COALESCE_BYTES,
+            flush_interval=DEEPGRAM_FLUSH_INTERVAL)
+        session.upstream = deepgram_socket
+        await deepgram_socket.connect()
         logger.info(f"Started Deepgram connection for client {client_id}")
         
+        capture = session.capture
+        
         # Handle incoming transcriptions from Deepgram in background
         async def process_transcriptions():
             async for message in deepgram_socket:
-                logger.debug(f"Received transcript from Deepgram: {json.dumps(message)}")
-                await websocket.send_text(json.dumps(message))
+                if encoder:
+                    if capture:
+                        capture.transcript(json.dumps(message))
+                    payload = encoder.encode(message)
+                    await websocket.send_bytes(payload)
+                    session.record_out(len(payload))
+                    continue
+                text = json.dumps(message)
+                logger.debug(f"Received transcript from Deepgram: {text}")
+                if capture:
+                    capture.transcript(text)
+                await websocket.send_text(text)
+                session.record_out(len(text))
         
         # Start processing transcriptions in background
-        transcription_task = asyncio.create_task(process_transcriptions())
+        session.transcription_task = asyncio.create_task(process_transcriptions())
         
         # Process incoming audio data
-        try:
-            while True:
-                data = await websocket.receive_bytes()
-                logger.debug(f"Received {len(data)} bytes of audio data")
-                deepgram_socket.send(data)
-        except WebSocketDisconnect:
-            logger.info(f"Client {client_id} disconnected")
-            transcription_task.cancel()
-        finally:
-            # Clean up Deepgram connection
-            if client_id in dg_connections:
-                deepgram_socket.close()
-                await deepgram_socket.wait_closed()
-                del dg_connections[client_id]
-                logger.info(f"Closed Deepgram connection for client {client_id}")
+        while not session.closed:
+            data = await websocket.receive_bytes()
+            if session.closed:
+                # Closing (reaper or drain); the upstream no longer takes audio
+                break
+            logger.debug(f"Received {len(data)} bytes of audio data")
+            session.record_in(len(data))
+            if capture:
+                capture.audio(data)
+            await deepgram_socket.send(data)
     
+    except WebSocketDisconnect:
+        logger.info(f"Client {client_id} disconnected")
     except Exception as e:
-        logger.error(f"Error in websocket connection: {str(e)}", exc_info=True)
-        try:
-            await websocket.send_text(json.dumps({"type": "error", "message": str(e)}))
-        except:
-            pass
-    finally:
-        if client_id in active_connections:
-            del active_connections[client_id]
-        if client_id in dg_connections:
+        if session.closed:
+            # Closed underneath us, e.g. by the idle reaper
+            logger.info(f"Session {client_id} closed: {str(e)}")
+        else:
+            logger.error(f"Error in websocket connection: {str(e)}", exc_info=True)
             try:
-                await dg_connections[client_id].finish()
+                await send_control(websocket, encoder, {"type": "error", "message": str(e)})
             except:
                 pass
-            del dg_connections[client_id]
+    finally:
+        await sessions.close(session)
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains live sessions on SIGTERM before shutting down."""
+
+    drain_requested = False
+
+    def handle_exit(self, sig, frame):
+        # The first SIGTERM starts a drain; a second signal or SIGINT exits immediately
+        if sig == signal.SIGTERM and not self.drain_requested:
+            logger.info("Received SIGTERM, draining sessions before shutdown")
+            self.drain_requested = True
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        # Signal handlers may run outside the event loop, so start the drain from here
+        if self.drain_requested:
+            if sessions.start_drain(DRAIN_GRACE_PERIOD, DRAIN_RECONNECT_SPREAD).done():
+                self.should_exit = True
+        return await super().on_tick(counter)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("deepgram_app:app", host="0.0.0.0", port=port, reload=False)
\ No newline at end of file
+    # Pass the app object so the server and the app share this module's session registry
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, reload=False)
+    DrainingServer(config).run()
\ No newline at end of file
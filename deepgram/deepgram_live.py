@@ -0,0 +1,182 @@
+"""
+Minimal Deepgram live transcription client built directly on websockets.
+
+Speaks the live protocol without the SDK: binary audio frames go out, JSON
+results come back, and KeepAlive / Finalize / CloseStream are sent as JSON
+text control messages. Audio is written straight to the socket by default;
+setting coalesce_bytes batches small frames into larger writes, flushed when
+the batch fills or flush_interval elapses.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlencode
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://api.deepgram.com/v1"
+
+KEEPALIVE_MESSAGE = json.dumps({"type": "KeepAlive"})
+FINALIZE_MESSAGE = json.dumps({"type": "Finalize"})
+CLOSE_STREAM_MESSAGE = json.dumps({"type": "CloseStream"})
+
+
+def live_url(api_url: str, options: Dict[str, Any]) -> str:
+    """Build the /listen websocket URL from an https API base and options."""
+    base = api_url.rstrip("/")
+    if base.startswith("https://"):
+        base = "wss://" + base[len("https://"):]
+    elif base.startswith("http://"):
+        base = "ws://" + base[len("http://"):]
+    query = urlencode({
+        key: str(value).lower() if isinstance(value, bool) else value
+        for key, value in options.items()
+    })
+    return f"{base}/listen?{query}"
+
+
+class DeepgramLive:
+    """One live transcription stream to Deepgram."""
+
+    __slots__ = ("url", "_api_key", "_keepalive_interval", "_coalesce_bytes", "_flush_interval",
+                 "_write_limit", "_socket", "_keepalive_task", "_flush_handle", "_flush_task", "_buffer",
+                 "_last_sent", "_closed")
+
+    def __init__(self, api_key: str, options: Dict[str, Any], api_url: str = DEFAULT_API_URL,
+                 keepalive_interval: float = 5.0, coalesce_bytes: int = 0,
+                 flush_interval: float = 0.02, write_limit: int = 2 ** 16):
+        self.url = live_url(api_url, options)
+        self._api_key = api_key
+        self._keepalive_interval = keepalive_interval
+        self._coalesce_bytes = coalesce_bytes
+        self._flush_interval = flush_interval
+        self._write_limit = write_limit
+        self._socket = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._buffer = bytearray()
+        self._last_sent = 0.0
+        self._closed = False
+
+    async def connect(self) -> "DeepgramLive":
+        socket = await websockets.connect(
+            self.url,
+            extra_headers={"Authorization": f"Token {self._api_key}"},
+            write_limit=self._write_limit,
+            # Deepgram drives liveness with KeepAlive; avoid extra ping traffic
+            ping_interval=None,
+        )
+        if self._closed:
+            # finish() ran while the handshake was in flight; don't leave a billed stream open
+            await socket.close()
+            raise ConnectionError("Deepgram stream was closed while connecting")
+        self._socket = socket
+        self._last_sent = time.monotonic()
+        if self._keepalive_interval:
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+        return self
+
+    def buffered_bytes(self) -> int:
+        """Bytes held locally: the coalescing batch, the unsent transport buffer
+        and results received but not yet consumed."""
+        total = len(self._buffer)
+        if self._socket is not None:
+            transport = self._socket.transport
+            if transport is not None:
+                total += transport.get_write_buffer_size()
+            for message in getattr(self._socket, "messages", ()):
+                total += len(message)
+        return total
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            async for message in self._socket:
+                if isinstance(message, str):
+                    yield json.loads(message)
+        except websockets.exceptions.ConnectionClosedError as e:
+            logger.warning(f"Deepgram connection closed with error: {e}")
+
+    async def send(self, data: bytes):
+        """Send audio, batching it first when coalescing is enabled."""
+        if not self._coalesce_bytes:
+            await self._write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= self._coalesce_bytes:
+            await self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self._flush_interval, self._start_timed_flush)
+
+    def _start_timed_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self._timed_flush())
+
+    async def _timed_flush(self):
+        # Runs detached from any caller, so failures are logged here rather than lost
+        try:
+            await self.flush()
+        except websockets.exceptions.ConnectionClosed as e:
+            logger.warning(f"Dropped buffered audio, Deepgram connection closed: {e}")
+        except Exception as e:
+            logger.error(f"Timed flush to Deepgram failed: {e}", exc_info=True)
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            await self._write(data)
+
+    async def _write(self, data: bytes):
+        self._last_sent = time.monotonic()
+        await self._socket.send(data)
+
+    async def _send_control(self, message: str):
+        self._last_sent = time.monotonic()
+        await self._socket.send(message)
+
+    async def _keepalive(self):
+        try:
+            while True:
+                await asyncio.sleep(self._keepalive_interval)
+                if time.monotonic() - self._last_sent >= self._keepalive_interval:
+                    await self._send_control(KEEPALIVE_MESSAGE)
+        except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+            pass
+
+    async def finalize(self):
+        """Ask Deepgram to emit finals for all audio received so far."""
+        await self.flush()
+        await self._send_control(FINALIZE_MESSAGE)
+
+    async def finish(self, timeout: float = 5.0) -> bool:
+        """
+        Close the stream gracefully, letting Deepgram deliver pending results.
+
+        Returns True if an open socket was closed. Calling it before connect()
+        completes makes the pending connect close its socket instead.
+        """
+        self._closed = True
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        if self._socket is None:
+            return False
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        try:
+            await self.flush()
+            await self._send_control(CLOSE_STREAM_MESSAGE)
+            await asyncio.wait_for(self._socket.wait_closed(), timeout=timeout)
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            pass
+        finally:
+            await self._socket.close()
+        return True
@@ -0,0 +1,294 @@
+"""
+Replay a session capture through the relay for performance regression testing.
+
+The tool starts a local fake Deepgram upstream that answers with the captured
+transcript messages, then streams the captured audio frames into the relay
+at their original pacing (or accelerated with --speed). Each transcript is
+released by the fake upstream once it has received as many audio bytes as
+the real upstream had when it produced that message, so every run is
+deterministic and the measured latency is the relay's own overhead.
+
+Start the build under test pointed at the fake upstream:
+    CAPTURE_DIR= DEEPGRAM_API_URL=http://127.0.0.1:8765/v1 python deepgram_app.py
+
+Then replay and compare:
+    python replay_capture.py replay ws://localhost:8000 session.dgcap --output base.json
+    python replay_capture.py replay ws://localhost:8000 session.dgcap --output candidate.json
+    python replay_capture.py compare base.json candidate.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+
+from session_capture import KIND_AUDIO, KIND_DROPPED, KIND_TRANSCRIPT, read_capture
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Message types Deepgram sends on a live stream; anything else the relay sends
+# (errors, Reconnect hints) is proxy-generated and has no captured counterpart
+UPSTREAM_MESSAGE_TYPES = {"Results", "Metadata", "UtteranceEnd", "SpeechStarted"}
+
+
+def load_capture(path: str, allow_lossy: bool = False) -> Tuple[List[Tuple[float, bytes]], List[Tuple[int, str]]]:
+    """
+    Split a capture into audio frames and transcripts.
+
+    A capture that dropped records has shifted byte thresholds, so replaying
+    it is not deterministic; it is refused unless allow_lossy is set.
+
+    Returns:
+        frames: (offset seconds, audio bytes) in arrival order
+        transcripts: (audio bytes received before the message, message text)
+    """
+    frames = []
+    transcripts = []
+    audio_bytes = 0
+    dropped = 0
+    for kind, offset, payload in read_capture(path):
+        if kind == KIND_AUDIO:
+            frames.append((offset, payload))
+            audio_bytes += len(payload)
+        elif kind == KIND_TRANSCRIPT:
+            transcripts.append((audio_bytes, payload.decode("utf-8")))
+        elif kind == KIND_DROPPED:
+            dropped += struct.unpack("<I", payload)[0]
+    if dropped:
+        if not allow_lossy:
+            raise ValueError(f"{path} is lossy ({dropped} records dropped during capture); "
+                             f"pass --allow-lossy to replay it anyway")
+        logger.warning(f"{path} is lossy ({dropped} records dropped), replay timings are not deterministic")
+    return frames, transcripts
+
+
+class FakeUpstream:
+    """Mimics the Deepgram live endpoint for a single capture."""
+
+    def __init__(self, transcripts: List[Tuple[int, str]]):
+        self.transcripts = transcripts
+        self.received = 0
+        self.connected_at: Optional[float] = None
+        self.finished = asyncio.Event()
+        self._released = 0
+        self._lock = asyncio.Lock()
+
+    async def _release(self, websocket, limit):
+        async with self._lock:
+            while self._released < len(self.transcripts) and self.transcripts[self._released][0] <= limit:
+                await websocket.send(self.transcripts[self._released][1])
+                self._released += 1
+
+    async def _flush_when_finished(self, websocket):
+        await self.finished.wait()
+        await self._release(websocket, float("inf"))
+
+    async def handler(self, websocket, path=None):
+        self.connected_at = time.perf_counter()
+        flusher = asyncio.create_task(self._flush_when_finished(websocket))
+        # Messages captured before any audio arrived go out immediately
+        await self._release(websocket, 0)
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes) and message:
+                    self.received += len(message)
+                    await self._release(websocket, self.received)
+                    continue
+                if isinstance(message, str):
+                    try:
+                        control = json.loads(message)
+                    except json.JSONDecodeError:
+                        continue
+                    if control.get("type") != "CloseStream":
+                        continue
+                # CloseStream or an empty frame ends the stream: flush the remaining finals
+                await self._release(websocket, float("inf"))
+                break
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            flusher.cancel()
+        await websocket.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    return {
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+    }
+
+
+async def replay(relay_url: str, capture_path: str, upstream_port: int, speed: float,
+                 drain_timeout: float, allow_lossy: bool = False) -> Dict:
+    frames, transcripts = load_capture(capture_path, allow_lossy=allow_lossy)
+    logger.info(f"Loaded {len(frames)} audio frames and {len(transcripts)} transcripts from {capture_path}")
+
+    # Send time of the frame that satisfies each transcript's byte threshold;
+    # None means the message was captured before any audio
+    trigger_times: List[Optional[float]] = [None] * len(transcripts)
+    latencies: List[float] = []
+    errors: List[str] = []
+    all_received = asyncio.Event()
+    if not transcripts:
+        all_received.set()
+
+    upstream = FakeUpstream(transcripts)
+    async with websockets.serve(upstream.handler, "127.0.0.1", upstream_port):
+        # Messages captured before any audio are released as soon as the relay's
+        # upstream connection opens, so they are timed from that moment
+        next_transcript = 0
+        while next_transcript < len(transcripts) and transcripts[next_transcript][0] == 0:
+            next_transcript += 1
+
+        async with websockets.connect(relay_url) as websocket:
+
+            async def receive():
+                index = 0
+                async for message in websocket:
+                    now = time.perf_counter()
+                    try:
+                        data = json.loads(message)
+                    except (json.JSONDecodeError, TypeError):
+                        continue
+                    if not isinstance(data, dict):
+                        continue
+                    message_type = data.get("type", "Results")
+                    if message_type == "error":
+                        errors.append(data.get("message", ""))
+                        continue
+                    if message_type not in UPSTREAM_MESSAGE_TYPES:
+                        continue
+                    if index < len(transcripts):
+                        triggered = trigger_times[index]
+                        if triggered is None:
+                            triggered = upstream.connected_at
+                        latencies.append((now - triggered) * 1000.0)
+                        index += 1
+                        if index == len(transcripts):
+                            all_received.set()
+
+            receiver = asyncio.create_task(receive())
+            started = time.perf_counter()
+            sent_bytes = 0
+            for offset, frame in frames:
+                if speed > 0:
+                    delay = started + offset / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                sent_bytes += len(frame)
+                now = time.perf_counter()
+                while next_transcript < len(transcripts) and transcripts[next_transcript][0] <= sent_bytes:
+                    trigger_times[next_transcript] = now
+                    next_transcript += 1
+                await websocket.send(frame)
+
+            # Trailing finals are produced when the upstream stream ends; flush them
+            # once the relay has forwarded every frame and time them from there
+            deadline = time.perf_counter() + drain_timeout
+            while upstream.received < sent_bytes and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            for index in range(next_transcript, len(transcripts)):
+                trigger_times[index] = now
+            upstream.finished.set()
+            try:
+                await asyncio.wait_for(all_received.wait(), timeout=max(0.0, deadline - now))
+            except asyncio.TimeoutError:
+                logger.warning("Timed out waiting for remaining transcripts")
+            receiver.cancel()
+
+    report = {
+        "capture": capture_path,
+        "speed": speed,
+        "frames": len(frames),
+        "transcripts_expected": len(transcripts),
+        "transcripts_received": len(latencies),
+        "errors": errors,
+        "latency_ms": summarize(latencies),
+        "samples_ms": latencies,
+    }
+    return report
+
+
+def compare(baseline: Dict, candidate: Dict):
+    print(f"{'metric':<10}{'baseline':>12}{'candidate':>12}{'delta':>12}{'change':>10}")
+    for metric, base_value in baseline.get("latency_ms", {}).items():
+        cand_value = candidate.get("latency_ms", {}).get(metric)
+        if cand_value is None:
+            continue
+        delta = cand_value - base_value
+        change = f"{delta / base_value * 100:+.1f}%" if base_value else "n/a"
+        print(f"{metric:<10}{base_value:>12.2f}{cand_value:>12.2f}{delta:>+12.2f}{change:>10}")
+    for key in ("transcripts_expected", "transcripts_received"):
+        print(f"{key}: {baseline.get(key)} -> {candidate.get(key)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Deepgram relay session captures")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a capture through a running relay")
+    replay_parser.add_argument("relay_url", help="Relay websocket URL, e.g. ws://localhost:8000")
+    replay_parser.add_argument("capture", help="Path to a .dgcap capture file")
+    replay_parser.add_argument("--upstream-port", type=int, default=8765,
+                               help="Port for the fake Deepgram upstream")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Playback speed multiplier, 0 sends as fast as possible")
+    replay_parser.add_argument("--drain-timeout", type=float, default=10.0,
+                               help="Seconds to wait for transcripts after the last frame")
+    replay_parser.add_argument("--output", help="Write the JSON latency report here")
+    replay_parser.add_argument("--allow-lossy", action="store_true",
+                               help="Replay captures that dropped records (results are not deterministic)")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two replay reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        try:
+            report = asyncio.run(replay(args.relay_url, args.capture, args.upstream_port,
+                                        args.speed, args.drain_timeout, args.allow_lossy))
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        logger.info(f"Latency (ms): {json.dumps(report['latency_ms'])}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Wrote report to {args.output}")
+        if report["transcripts_received"] < report["transcripts_expected"]:
+            sys.exit(1)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        compare(baseline, candidate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Session capture for the Deepgram relay.
+
+When CAPTURE_DIR is set, every session writes its inbound audio frames and
+the upstream transcript messages to an append-only binary file in that
+directory. Writes happen on a single background thread so the websocket
+handler only pays for a queue put.
+
+File layout:
+    header:  MAGIC
+    record:  kind (uint8) | offset seconds since session start (float64)
+             | payload length (uint32) | payload
+
+If the writer falls behind, records are dropped rather than blocking the
+relay, and a KIND_DROPPED trailer marks the file as lossy.
+"""
+import os
+import queue
+import struct
+import threading
+import time
+import logging
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DGCAP1\n"
+RECORD_HEADER = struct.Struct("<BdI")
+
+KIND_AUDIO = 1
+KIND_TRANSCRIPT = 2
+# Trailer written on close when records were dropped; payload is the count (uint32)
+KIND_DROPPED = 3
+
+# Bound the backlog so a slow disk can never grow memory without limit;
+# records beyond this are dropped and counted instead of blocking the relay.
+MAX_PENDING_RECORDS = 10000
+# How often the writer checks for close requests while no records arrive
+CLOSE_POLL_INTERVAL = 0.5
+
+
+class _CaptureWriterThread:
+    """Single background thread that owns every open capture file."""
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=MAX_PENDING_RECORDS)
+        # Close requests go through an unbounded side channel so closing a
+        # session never blocks the event loop on a full record queue
+        self._closes: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="session-capture-writer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, path: str, data: bytes) -> bool:
+        """Queue bytes to append to path; returns False if dropped because the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((path, data))
+            return True
+        except queue.Full:
+            return False
+
+    def close(self, path: str, records: int, dropped: int):
+        """Close path once its queued records are written, without ever blocking."""
+        self._ensure_started()
+        self._closes.put((path, records, dropped))
+
+    def _run(self):
+        files = {}
+        written: Dict[str, int] = {}
+        # path -> (records queued before close, records dropped)
+        closing: Dict[str, Tuple[int, int]] = {}
+        while True:
+            try:
+                path, data = self._queue.get(timeout=CLOSE_POLL_INTERVAL)
+            except queue.Empty:
+                path = None
+            try:
+                if path is not None:
+                    handle = files.get(path)
+                    if handle is None:
+                        handle = open(path, "ab")
+                        if handle.tell() == 0:
+                            handle.write(MAGIC)
+                        files[path] = handle
+                    handle.write(data)
+                    written[path] = written.get(path, 0) + 1
+                if path is None or self._queue.empty():
+                    for open_handle in files.values():
+                        open_handle.flush()
+            except Exception as e:
+                logger.error(f"Session capture write failed for {path}: {e}")
+                if path is not None:
+                    written[path] = written.get(path, 0) + 1
+
+            while True:
+                try:
+                    close_path, records, dropped = self._closes.get_nowait()
+                except queue.Empty:
+                    break
+                closing[close_path] = (records, dropped)
+            for close_path, (records, dropped) in list(closing.items()):
+                # Records for a path are always queued before its close request,
+                # so the file is complete once every one of them has been written
+                if written.get(close_path, 0) < records:
+                    continue
+                del closing[close_path]
+                written.pop(close_path, None)
+                try:
+                    handle = files.pop(close_path, None)
+                    if dropped:
+                        if handle is None:
+                            handle = open(close_path, "ab")
+                            if handle.tell() == 0:
+                                handle.write(MAGIC)
+                        payload = struct.pack("<I", dropped)
+                        handle.write(RECORD_HEADER.pack(KIND_DROPPED, 0.0, len(payload)) + payload)
+                    if handle is not None:
+                        handle.close()
+                except Exception as e:
+                    logger.error(f"Session capture close failed for {close_path}: {e}")
+
+
+_writer = _CaptureWriterThread()
+
+
+class SessionCapture:
+    """Records one session's audio and transcript traffic."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self.dropped = 0
+        self._started = time.monotonic()
+        self._closed = False
+
+    def _record(self, kind: int, payload: bytes):
+        if self._closed:
+            return
+        offset = time.monotonic() - self._started
+        if _writer.submit(self.path, RECORD_HEADER.pack(kind, offset, len(payload)) + payload):
+            self.records += 1
+        else:
+            self.dropped += 1
+
+    def audio(self, data: bytes):
+        self._record(KIND_AUDIO, data)
+
+    def transcript(self, text: str):
+        self._record(KIND_TRANSCRIPT, text.encode("utf-8"))
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            if self.dropped:
+                logger.warning(f"Session capture {self.path} dropped {self.dropped} records, "
+                               f"marking it lossy")
+            _writer.close(self.path, self.records, self.dropped)
+
+
+def open_capture(client_id: str) -> Optional[SessionCapture]:
+    """Return a capture for client_id if CAPTURE_DIR is configured."""
+    capture_dir = os.getenv("CAPTURE_DIR")
+    if not capture_dir:
+        return None
+    try:
+        os.makedirs(capture_dir, exist_ok=True)
+    except OSError as e:
+        logger.error(f"Session capture disabled, cannot create {capture_dir}: {e}")
+        return None
+    path = os.path.join(capture_dir, f"{client_id}.dgcap")
+    logger.info(f"Capturing session {client_id} to {path}")
+    return SessionCapture(path)
+
+
+def read_capture(path: str) -> Iterator[Tuple[int, float, bytes]]:
+    """Yield (kind, offset, payload) records from a capture file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session capture file")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # A truncated tail means the process died mid-write; stop there.
+                return
+            kind, offset, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, offset, payload
@@ -0,0 +1,275 @@
+"""
+Per-session state and the registry of live sessions.
+
+Each client connection is one Session holding its client websocket, its
+Deepgram upstream, traffic counters and last-activity time. Session.close()
+is idempotent and tears everything down, so every exit path of the websocket
+handler can call it. The registry's reaper closes sessions whose client has
+stopped sending audio without disconnecting, and drain() hands sessions off
+before an instance is stopped.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+from transcript_codec import send_control
+
+logger = logging.getLogger(__name__)
+
+def process_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Close code sent to clients reaped for inactivity (1001 "going away")
+IDLE_CLOSE_CODE = 1001
+# Close code for sessions still open when a drain's grace period ends (1012 "service restart")
+DRAIN_CLOSE_CODE = 1012
+# Close code for connections refused while draining (1013 "try again later")
+DRAINING_REJECT_CODE = 1013
+
+
+def reconnect_message(retry_after_ms: int, grace_period_ms: int) -> Dict:
+    """Control message telling a client to reconnect to another instance."""
+    return {
+        "type": "Reconnect",
+        "reason": "draining",
+        "retry_after_ms": retry_after_ms,
+        "grace_period_ms": grace_period_ms,
+    }
+
+
+class Session:
+    """State for one client connection."""
+
+    __slots__ = ("client_id", "websocket", "upstream", "capture", "encoder", "transcription_task",
+                 "created", "last_activity", "bytes_in", "bytes_out", "messages_in", "messages_out",
+                 "closed", "_closing")
+
+    def __init__(self, client_id: str, websocket, encoder=None, capture=None):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.encoder = encoder
+        self.capture = capture
+        self.upstream = None
+        self.transcription_task: Optional[asyncio.Task] = None
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.closed = False
+        self._closing: Optional[asyncio.Future] = None
+
+    def record_in(self, size: int):
+        self.bytes_in += size
+        self.messages_in += 1
+        self.last_activity = time.monotonic()
+
+    def record_out(self, size: int):
+        self.bytes_out += size
+        self.messages_out += 1
+
+    def buffered_bytes(self) -> int:
+        return self.upstream.buffered_bytes() if self.upstream is not None else 0
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "client_id": self.client_id,
+            "age_seconds": round(now - self.created, 3),
+            "idle_seconds": round(now - self.last_activity, 3),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "buffered_bytes": self.buffered_bytes(),
+            "encoding": self.encoder.subprotocol if self.encoder is not None else "json",
+        }
+
+    async def send_control(self, message: Dict):
+        """Send a proxy control message in the session's negotiated encoding."""
+        await send_control(self.websocket, self.encoder, message)
+
+    async def prepare_handoff(self, retry_after_ms: int, grace_period_ms: int):
+        """Flush pending finals upstream and tell the client when to reconnect."""
+        if self.upstream is not None:
+            # The upstream may still be connecting or already gone; the client
+            # must get its Reconnect hint either way
+            try:
+                await self.upstream.finalize()
+            except Exception as e:
+                logger.warning(f"Could not finalize Deepgram stream for client {self.client_id}: {e}")
+        await self.send_control(reconnect_message(retry_after_ms, grace_period_ms))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        """
+        Release the upstream, capture and client socket; safe to call more than once.
+
+        Later callers wait for the teardown already in progress, so the handler
+        cannot return (and drop the connection) before the first caller's close
+        code has been sent.
+        """
+        if self._closing is None:
+            self.closed = True
+            self._closing = asyncio.ensure_future(self._close(code, reason))
+        # Shielded so a cancelled caller does not abort the teardown half way
+        await asyncio.shield(self._closing)
+
+    async def _close(self, code: int, reason: str):
+        # Finish upstream before stopping the relay task so finals produced by
+        # CloseStream still reach a client that is connected
+        if self.upstream is not None:
+            try:
+                if await self.upstream.finish():
+                    logger.info(f"Closed Deepgram connection for client {self.client_id}")
+            except Exception as e:
+                logger.warning(f"Error closing Deepgram connection for client {self.client_id}: {e}")
+        if self.transcription_task is not None:
+            self.transcription_task.cancel()
+        if self.capture is not None:
+            self.capture.close()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # Already closed by the client
+            pass
+
+
+class SessionRegistry:
+    """Live sessions keyed by client id, with an idle-session reaper and drain mode."""
+
+    def __init__(self, idle_timeout: float = 60.0, reap_interval: float = 10.0):
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.draining = False
+        self.baseline_rss: Optional[int] = None
+        self.drain_task: Optional[asyncio.Task] = None
+        self._sessions: Dict[str, Session] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: Session):
+        self._sessions[session.client_id] = session
+
+    def get(self, client_id: str) -> Optional[Session]:
+        return self._sessions.get(client_id)
+
+    def sessions(self) -> List[Session]:
+        return list(self._sessions.values())
+
+    async def close(self, session: Session, code: int = 1000, reason: str = ""):
+        self._sessions.pop(session.client_id, None)
+        await session.close(code=code, reason=reason)
+
+    async def reap_idle(self) -> int:
+        """Close sessions with no inbound audio for idle_timeout seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        stalled = [s for s in self._sessions.values() if s.last_activity < cutoff]
+        for session in stalled:
+            logger.info(f"Reaping idle session {session.client_id}")
+            await self.close(session, code=IDLE_CLOSE_CODE, reason="idle timeout")
+        return len(stalled)
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.error(f"Idle session reaper failed: {e}", exc_info=True)
+
+    def record_baseline(self):
+        """Sample process RSS with no sessions open, as the zero point for per-session memory."""
+        self.baseline_rss = process_rss_bytes()
+
+    def start_reaper(self):
+        if self.idle_timeout > 0 and self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_forever())
+
+    def stop_reaper(self):
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+
+    def start_drain(self, grace_period: float, reconnect_spread: float) -> asyncio.Task:
+        """Start drain() in the background, keeping the task so it is not lost."""
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain(grace_period, reconnect_spread))
+            self.drain_task.add_done_callback(self._drain_done)
+        return self.drain_task
+
+    @staticmethod
+    def _drain_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Session drain failed", exc_info=task.exception())
+
+    async def drain(self, grace_period: float, reconnect_spread: float):
+        """
+        Stop admitting sessions and hand existing ones off to other instances.
+
+        Every session gets a Deepgram Finalize so pending finals are delivered,
+        and a Reconnect hint whose retry_after_ms is spread evenly (with jitter)
+        over reconnect_spread seconds so clients do not all reconnect at once.
+        Sessions still open after grace_period seconds are closed.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        spread_ms = int(min(reconnect_spread, grace_period) * 1000)
+        grace_ms = int(grace_period * 1000)
+        sessions = self.sessions()
+        logger.info(f"Draining {len(sessions)} sessions over {grace_period}s")
+
+        async def hand_off(index: int, session: Session):
+            retry_after_ms = int(spread_ms * (index + random.random()) / len(sessions))
+            try:
+                await session.prepare_handoff(retry_after_ms, grace_ms)
+            except Exception as e:
+                logger.warning(f"Could not hand off session {session.client_id}: {e}")
+
+        await asyncio.gather(*(hand_off(i, s) for i, s in enumerate(sessions)))
+
+        deadline = time.monotonic() + grace_period
+        while self._sessions and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        remaining = self.sessions()
+        if remaining:
+            logger.info(f"Grace period over, closing {len(remaining)} remaining sessions")
+        await asyncio.gather(*(self.close(s, code=DRAIN_CLOSE_CODE, reason="server draining")
+                               for s in remaining))
+
+    def stats(self) -> Dict:
+        """
+        Session stats plus process memory for capacity planning.
+
+        Per-session memory is the process RSS growth since startup divided by
+        the active sessions, so it covers everything a session really costs
+        (client and upstream sockets, their frame buffers, tasks, encoder),
+        not just the objects this module owns. RSS rarely shrinks after
+        sessions close, so read it at a steady session count.
+        """
+        sessions = [s.stats() for s in self._sessions.values()]
+        rss = process_rss_bytes()
+        per_session = None
+        if rss is not None and self.baseline_rss is not None and sessions:
+            per_session = max(0, rss - self.baseline_rss) // len(sessions)
+        return {
+            "draining": self.draining,
+            "active_sessions": len(sessions),
+            "process_rss_bytes": rss,
+            "baseline_rss_bytes": self.baseline_rss,
+            "rss_per_session_bytes": per_session,
+            "total_buffered_bytes": sum(s["buffered_bytes"] for s in sessions),
+            "sessions": sessions,
+        }
@@ -0,0 +1,116 @@
+"""
+Compact binary encodings for transcripts sent to clients.
+
+Clients opt in by requesting a WebSocket subprotocol on connect:
+    transcript.msgpack  MessagePack
+    transcript.cbor     CBOR (only offered when cbor2 is installed)
+
+Binary sessions receive a projection of each Deepgram "Results" message that
+keeps the fields clients read (transcript, confidence, is_final, ...) in the
+same nested shape, dropping word arrays and metadata unless ?words=true is
+passed. Other message types are forwarded unchanged. Sessions that request
+no subprotocol keep receiving the full JSON text messages.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import msgpack
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+SUBPROTOCOL_MSGPACK = "transcript.msgpack"
+SUBPROTOCOL_CBOR = "transcript.cbor"
+
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    SUBPROTOCOL_MSGPACK: msgpack.packb,
+}
+if cbor2 is not None:
+    ENCODERS[SUBPROTOCOL_CBOR] = cbor2.dumps
+
+# Fields kept from a Results message; True keeps the value as-is, a dict
+# recurses into a nested object and a one-element list maps over an array.
+RESULTS_FIELDS = {
+    "type": True,
+    "start": True,
+    "duration": True,
+    "is_final": True,
+    "speech_final": True,
+    "from_finalize": True,
+    "channel_index": True,
+    "channel": {
+        "alternatives": [{
+            "transcript": True,
+            "confidence": True,
+        }],
+    },
+}
+
+WORD_FIELDS = {
+    "word": True,
+    "punctuated_word": True,
+    "start": True,
+    "end": True,
+    "confidence": True,
+}
+
+
+def negotiate(requested: Iterable[str]) -> Optional[str]:
+    """Pick the first subprotocol the client requested that we can encode."""
+    for subprotocol in requested:
+        if subprotocol in ENCODERS:
+            return subprotocol
+    return None
+
+
+def _compile(spec) -> Callable[[Any], Any]:
+    """Turn a field spec into a projection function, resolved once up front."""
+    if spec is True:
+        return lambda value: value
+    if isinstance(spec, list):
+        item = _compile(spec[0])
+        return lambda value: [item(v) for v in value] if isinstance(value, list) else value
+    fields = tuple((name, _compile(sub)) for name, sub in spec.items())
+
+    def project(value):
+        if not isinstance(value, dict):
+            return value
+        return {name: fn(value[name]) for name, fn in fields if name in value}
+
+    return project
+
+
+def build_projection(include_words: bool = False) -> Callable[[Any], Any]:
+    """Build the per-session projection for Results messages."""
+    spec = dict(RESULTS_FIELDS)
+    if include_words:
+        alternative = dict(spec["channel"]["alternatives"][0], words=[WORD_FIELDS])
+        spec["channel"] = {"alternatives": [alternative]}
+    return _compile(spec)
+
+
+class TranscriptEncoder:
+    """Encodes Deepgram messages for one binary session."""
+
+    def __init__(self, subprotocol: str, include_words: bool = False):
+        self.subprotocol = subprotocol
+        self._encode = ENCODERS[subprotocol]
+        self._project = build_projection(include_words)
+
+    def encode(self, message: Any) -> bytes:
+        if isinstance(message, dict) and message.get("type", "Results") == "Results" and "channel" in message:
+            message = self._project(message)
+        return self._encode(message)
+
+
+async def send_control(websocket, encoder: Optional[TranscriptEncoder], message: Dict[str, Any]):
+    """Send a proxy-generated message (errors, hints) in the client's negotiated encoding."""
+    if encoder is not None:
+        await websocket.send_bytes(encoder.encode(message))
+    else:
+        await websocket.send_text(json.dumps(message))